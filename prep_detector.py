@@ -2,18 +2,40 @@
 
 import argparse
 import os
-import sys
-import csv
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-import av
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict
 import yaml
 import json
 
+# Threads given to each ffmpeg when transcoding several videos at once
+FFMPEG_THREADS = 4
+# Concurrent NVENC sessions allowed on consumer GPUs
+NVENC_SESSIONS = 3
+
+
+@lru_cache(maxsize=None)
+def nvenc_available() -> bool:
+    """Check once whether the local ffmpeg build provides h264_nvenc"""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True
+        )
+    except OSError:
+        return False
+    return "h264_nvenc" in result.stdout
+
 
 def encode_video(
-    input_video: str, output_video: str, width: int, height: int, fps: int = 30
+    input_video: str,
+    output_video: str,
+    width: int,
+    height: int,
+    fps: int = 30,
+    threads: int = 0,
+    use_nvenc: bool = False,
 ) -> bool:
     """Encode entire video using ffmpeg with highest resolution"""
     try:
@@ -24,29 +46,59 @@ def encode_video(
         # Ensure output directory exists
         os.makedirs(os.path.dirname(output_video), exist_ok=True)
 
-        # Build ffmpeg command
-        cmd = [
-            "ffmpeg",
-            "-i",
-            input_video,
-            "-c:v",
-            "libx264",
-            "-preset",
-            "medium",
-            "-crf",
-            "23",
-            "-pix_fmt",
-            "yuv420p",
-            "-s",
-            f"{adjusted_width}x{adjusted_height}",
-            "-r",
-            str(fps),
-            "-y",  # Overwrite output file
-            output_video,
-        ]
+        def run_ffmpeg(nvenc: bool):
+            # Hardware encode when requested and supported; libx264 otherwise
+            if nvenc:
+                hwaccel_args = ["-hwaccel", "cuda"]
+                codec_args = [
+                    "-c:v",
+                    "h264_nvenc",
+                    "-preset",
+                    "p4",
+                    "-rc",
+                    "vbr",
+                    "-cq",
+                    "23",
+                    "-b:v",
+                    "0",
+                ]
+            else:
+                hwaccel_args = []
+                codec_args = ["-c:v", "libx264", "-preset", "medium", "-crf", "23"]
+
+            # Build ffmpeg command
+            cmd = [
+                "ffmpeg",
+                "-loglevel",
+                "error",
+                "-nostats",
+                *hwaccel_args,
+                "-i",
+                input_video,
+                *codec_args,
+                "-pix_fmt",
+                "yuv420p",
+                "-s",
+                f"{adjusted_width}x{adjusted_height}",
+                "-r",
+                str(fps),
+                "-threads",
+                str(threads),  # 0 lets ffmpeg pick
+                "-y",  # Overwrite output file
+                output_video,
+            ]
+
+            # Run ffmpeg; only errors are written to stderr, stdout is unused
+            return subprocess.run(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+            )
 
-        # Run ffmpeg
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        nvenc = use_nvenc and nvenc_available()
+        result = run_ffmpeg(nvenc)
+        if result.returncode != 0 and nvenc:
+            # e.g. no free NVENC session; the software encoder still works
+            print(f"NVENC encode failed, retrying with libx264: {result.stderr}")
+            result = run_ffmpeg(False)
 
         if result.returncode == 0:
             print(f"{output_video}")
@@ -60,10 +112,7 @@ def encode_video(
         return False
 
 
-def generate_detector_input(config: Dict):
-    with open(config["detect_list"], "r") as f:
-        video_lists = [line.strip() for line in f]
-
+def generate_detector_input(config: Dict, video_lists: List[str]):
     if config["dataset_name"] == "Celeb-DF-v1":
         list_file_path = os.path.join(
             config["detector_input_dir"],
@@ -71,10 +120,12 @@ def generate_detector_input(config: Dict):
             config["dataset_name"],
             "List_of_testing_videos.txt",
         )
+        lines = [
+            f"{0 if 'Celeb-synthesis' in video_id else 1} {video_id}\n"
+            for video_id in video_lists
+        ]
         with open(list_file_path, "w") as f:
-            for video_id in video_lists:
-                label = 0 if "Celeb-synthesis" in video_id else 1
-                f.write(f"{label} {video_id}\n")
+            f.writelines(lines)
         print(f"Generated detector input list: {list_file_path}")
         print(f"Added {len(video_lists)} videos to the list")
         return list_file_path
@@ -103,6 +154,58 @@ def create_deepfakebench_symlinks(config: Dict):
     create_symlink(src, config["detector_eval_dest_dir"])
 
 
+def prepare_detector_video(config: Dict, video_id: str) -> Tuple[str, bool]:
+    """Transcode one received video for the detector if not done yet"""
+    print(f"Processing {video_id}")
+
+    input_video_config_path = os.path.join(
+        config["rtc_input_dir"],
+        config["dataset_name"],
+        str(Path(video_id).with_suffix(".json")),
+    )
+
+    rtc_output_video = os.path.join(
+        config["rtc_output_dir"],
+        config["dataset_name"],
+        str(Path(video_id).with_suffix(".ivf")),
+    )
+
+    # Added exp name to separate different experiments
+    detector_input_video = os.path.join(
+        config["detector_input_dir"],
+        config["experiment_id"],
+        config["dataset_name"],
+        str(Path(video_id).with_suffix(".mp4")),
+    )
+
+    # TODO
+    if not os.path.exists(detector_input_video):
+        with open(input_video_config_path, "r") as f:
+            input_video_config = json.load(f)
+
+            width = input_video_config["Width"]
+            height = input_video_config["Height"]
+            fps = input_video_config["Fps"]
+
+            # Transcode
+            encode_ret = encode_video(
+                rtc_output_video,
+                detector_input_video,
+                width,
+                height,
+                fps,
+                threads=FFMPEG_THREADS,
+                use_nvenc=config.get("nvenc", False),
+            )
+            if not encode_ret:
+                print(
+                    f"Error encoding video {rtc_output_video} -> {detector_input_video}"
+                )
+                return detector_input_video, False
+
+    return detector_input_video, True
+
+
 def main():
     parser = argparse.ArgumentParser(description="Format received video for detector")
     parser.add_argument(
@@ -112,59 +215,33 @@ def main():
 
     # Load configuration
     with open(args.config, "r") as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
     with open(config["detect_list"], "r") as f:
         video_lists = [line.strip() for line in f]
 
-    detector_input_videos = []
-
-    for video_id in video_lists:
-        print(f"Processing {video_id}")
-
-        input_video_config_path = os.path.join(
-            config["rtc_input_dir"],
-            config["dataset_name"],
-            video_id.replace(config["video_suffix"], ".json"),
-        )
-
-        rtc_output_video = os.path.join(
-            config["rtc_output_dir"],
-            config["dataset_name"],
-            video_id.replace(config["video_suffix"], ".ivf"),
-        )
-
-        # Added exp name to separate different experiments
-        detector_input_video = os.path.join(
-            config["detector_input_dir"],
-            config["experiment_id"],
-            config["dataset_name"],
-            video_id.replace(config["video_suffix"], ".mp4"),
-        )
-
-        # TODO
-        if not os.path.exists(detector_input_video):
-            with open(input_video_config_path, "r") as f:
-                input_video_config = json.load(f)
-
-                width = input_video_config["Width"]
-                height = input_video_config["Height"]
-                fps = input_video_config["Fps"]
+    # Each ffmpeg gets a fixed thread budget; run as many as the cores allow
+    max_workers = max(1, (os.cpu_count() or 1) // FFMPEG_THREADS)
+    if config.get("nvenc", False):
+        # Each worker opens its own encode session
+        max_workers = min(max_workers, NVENC_SESSIONS)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(prepare_detector_video, config, video_id)
+            for video_id in video_lists
+        ]
 
-                # Transcode
-                encode_ret = encode_video(
-                    rtc_output_video, detector_input_video, width, height, fps
-                )
-                if not encode_ret:
-                    print(
-                        f"Error encoding video {rtc_output_video} -> {detector_input_video}"
-                    )
+        # Iterate in submission order to keep the detector input order
+        detector_input_videos = []
+        for future in futures:
+            detector_input_video, encode_ret = future.result()
+            if not encode_ret:
+                executor.shutdown(cancel_futures=True)
                 return 1
-
-        detector_input_videos.append(detector_input_video)
+            detector_input_videos.append(detector_input_video)
 
     # Done transcoding; generate detector input
-    list_file_path = generate_detector_input(config)
+    list_file_path = generate_detector_input(config, video_lists)
     if not list_file_path:
         print("Error generating detector input list")
         return 1
@@ -1,91 +1,172 @@
 #!/usr/bin/env python3
 
 import argparse
+import av
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+from multiprocessing import Manager
 import json
 import os
+import shutil
 from os import path
+from pathlib import Path
 import subprocess
-from typing import List, Dict, Any
+from typing import Iterator, Dict, Any
 import yaml
 
 
-def find_files(dir: str, suffix: str) -> List[str]:
-    results: List[str] = []
-    for root, _, files in os.walk(dir):
-        for filename in files:
-            if filename.lower().endswith(suffix):
-                file_path = os.path.join(root, filename)
-                results.append(file_path)
-    return results
+def find_files(dir: str, suffix: str) -> Iterator[str]:
+    suffix = suffix.lower()
+    stack = [dir]
+    while stack:
+        # Unreadable directories are skipped, as os.walk does
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # Like os.walk, do not descend into symlinked directories
+                    if not entry.is_symlink():
+                        stack.append(entry.path)
+                elif entry.name[-len(suffix) :].lower() == suffix:
+                    yield entry.path
+
+
+# Config fields derived from probing the source video
+PROBE_FIELDS = ("Width", "Height", "Fps", "OriginalDurationMS")
+
+
+def probe_video(video_path: str) -> Dict[str, Any]:
+    # Read metadata in-process instead of spawning ffprobe
+    with av.open(video_path) as container:
+        if not container.streams.video:
+            return {}
+
+        # 1st video stream
+        video_stream = container.streams.video[0]
+
+        return {
+            "Width": video_stream.codec_context.width,
+            "Height": video_stream.codec_context.height,
+            # base_rate is what ffprobe reports as r_frame_rate
+            "Fps": int(video_stream.base_rate),
+            # Container duration is in AV_TIME_BASE (microsecond) units
+            "OriginalDurationMS": container.duration // 1000,
+        }
+
+
+def load_cached_probe(video_path: str, config_path: str) -> Dict[str, Any]:
+    """Reuse probe fields of a config written after the source last changed"""
+    try:
+        if os.path.getmtime(config_path) < os.path.getmtime(video_path):
+            return {}
+        with open(config_path, "r") as f:
+            cached_config = json.load(f)
+        return {field: cached_config[field] for field in PROBE_FIELDS}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+# Most NVDEC decodes to run at once; each ffmpeg opens its own CUDA context
+CUDA_DECODE_JOBS = 4
+
+
+@lru_cache(maxsize=None)
+def cuda_decode_available() -> bool:
+    """Check once for an NVIDIA GPU and an ffmpeg build with CUDA hwaccel"""
+    if shutil.which("nvidia-smi") is None:
+        return False
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-hwaccels"], capture_output=True, text=True
+        )
+    except OSError:
+        return False
+    return "cuda" in result.stdout.split()
 
 
 def process_video(
     video_path: str,
     output_path: str,
+    config_path: str,
     overwrite: bool,
     pixel_format: str,
     extra_duration_ms: int,
+    threads: int = 0,
+    gpu_slots=None,
 ):
     output_path = os.path.normpath(output_path)
 
-    # Convert video
-    if not overwrite and os.path.exists(output_path):
-        print(f"--> Overwrite set to false - skipping")
-    else:
-        cmd = [
-            "ffmpeg",
-            "-i",
-            video_path,
-            "-pix_fmt",
-            pixel_format,
-            "-y",
-            output_path,
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        if result.returncode != 0:
-            print(f"Error processing {video_path}: {result.stderr}")
-            return ""
-
-    # Generate config
-    cmd = [
-        "ffprobe",
-        "-v",
-        "quiet",
-        "-print_format",
-        "json",
-        "-show_format",
-        "-show_streams",
-        video_path,
-    ]
-
-    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-    data = json.loads(result.stdout)
-
-    # Find 1st video stream
-    video_stream = None
-    for stream in data["streams"]:
-        if stream["codec_type"] == "video":
-            video_stream = stream
-            break
-
-    if not video_stream:
+    # Probe the source first so files without a video stream are rejected
+    # before spending a full conversion on them; reruns reuse the last probe
+    probe = {} if overwrite else load_cached_probe(video_path, config_path)
+    if not probe:
+        probe = probe_video(video_path)
+    if not probe:
         print(f"No video stream found for {video_path}")
         return ""
 
-    # Extract duration from format
-    duration = float(data["format"]["duration"])
-    duration_ms = int(duration * 1000)
-
     # Generate config
     video_config = {
-        "Width": video_stream["width"],
-        "Height": video_stream["height"],
-        "Fps": int(eval(video_stream["r_frame_rate"])),
-        "OriginalDurationMS": duration_ms,
+        **probe,
         "VideoPath": output_path,
-        "DurationMS": duration_ms + extra_duration_ms,
+        "DurationMS": probe["OriginalDurationMS"] + extra_duration_ms,
     }
 
+    # Convert video
+    if not overwrite and os.path.exists(output_path):
+        print(f"--> Overwrite set to false - skipping")
+    else:
+
+        def run_ffmpeg(hwaccel: bool):
+            cmd = [
+                "ffmpeg",
+                "-loglevel",
+                "error",
+                "-nostats",
+                "-threads",
+                str(threads),  # decoder threads; 0 lets ffmpeg pick
+                # NVDEC decode; frames are copied back for the pixel format
+                # conversion, and ffmpeg falls back to software for other codecs
+                *(["-hwaccel", "cuda"] if hwaccel else []),
+                "-i",
+                video_path,
+                "-pix_fmt",
+                pixel_format,
+                "-y",
+                output_path,
+            ]
+            # Only errors reach stderr; stdout carries nothing useful
+            subprocess.run(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True
+            )
+
+        # Decode on the GPU when one of its slots is free. If the CUDA run
+        # fails (e.g. no device or out of memory), redo it on the CPU
+        decoded = False
+        if gpu_slots is not None and gpu_slots.acquire(blocking=False):
+            try:
+                run_ffmpeg(hwaccel=True)
+                decoded = True
+            except subprocess.CalledProcessError as e:
+                print(
+                    f"CUDA decode failed for {video_path}, retrying on CPU: "
+                    f"{e.stderr.decode(errors='replace')}"
+                )
+            finally:
+                gpu_slots.release()
+        if not decoded:
+            try:
+                run_ffmpeg(hwaccel=False)
+            except subprocess.CalledProcessError as e:
+                print(
+                    f"Error processing {video_path}: {e.stderr.decode(errors='replace')}"
+                )
+                return ""
+
     return video_config
 
 
@@ -98,47 +179,79 @@ def main():
 
     # Load configuration
     with open(args.config, "r") as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
     # Process all files in the input directory
-    video_files = find_files(
-        path.join(config["source"]["dir"], config["source"]["dataset_name"]),
-        config["source"]["video_suffix"],
+    video_files = sorted(
+        find_files(
+            path.join(config["source"]["dir"], config["source"]["dataset_name"]),
+            config["source"]["video_suffix"],
+        )
     )
     print(f"Found {len(video_files)} files")
 
-    video_files.sort()
-
-    generated_videos = []
-
-    for i, video in enumerate(video_files):
+    # Resolve output paths up front so workers only receive final paths
+    jobs = []
+    for video in video_files:
         # Example
         # video: Celeb-synthesis/Celeb-synthesis_00001.mp4
         # Actual path: Celeb-DF-v1/Celeb-synthesis/Celeb-synthesis_00001.mp4
         rel_path = os.path.relpath(video, start=config["source"]["dir"])
-        rtc_input_video = os.path.join(config["rtc_input"]["dir"], rel_path)
-        rtc_input_video = rtc_input_video.replace(
-            config["source"]["video_suffix"], ".yuv"
+        rtc_input_video = str(
+            Path(config["rtc_input"]["dir"], rel_path).with_suffix(".yuv")
         )
         os.makedirs(os.path.dirname(rtc_input_video), exist_ok=True)
-        video_config = process_video(
-            video,
-            rtc_input_video,
-            config["rtc_input"]["overwrite"],
-            config["rtc_input"]["pixel_format"],
-            config["rtc_input"]["duration_extension_ms"],
-        )
-        if not video_config:
-            print(f"Error processing {video}")
-            break
-        video_config_path = rtc_input_video.replace(".yuv", ".json")
-        with open(video_config_path, "w") as f:
-            json.dump(video_config, f, indent=4)
-            print(f"Processed {i+1}/{len(video_files)}: {video} -> {video_config_path}")
+        video_config_path = str(Path(rtc_input_video).with_suffix(".json"))
+        jobs.append((video, rel_path, rtc_input_video, video_config_path))
+
+    generated_videos = []
+
+    # Videos are independent; convert them concurrently, one ffmpeg per worker,
+    # and split the cores between workers so decoders don't oversubscribe
+    cpu_count = os.cpu_count() or 1
+    max_workers = max(1, min(cpu_count, len(jobs)))
+    ffmpeg_threads = max(1, cpu_count // max_workers)
+    # The Manager only runs to share GPU slots, so skip it on CPU-only hosts
+    hwaccel = cuda_decode_available()
+    with Manager() if hwaccel else nullcontext() as manager, ProcessPoolExecutor(
+        max_workers=max_workers
+    ) as executor:
+        # Bound the GPU decodes; other jobs decode on the CPU meanwhile
+        gpu_slots = manager.Semaphore(CUDA_DECODE_JOBS) if hwaccel else None
+        futures = [
+            executor.submit(
+                process_video,
+                video,
+                rtc_input_video,
+                video_config_path,
+                config["rtc_input"]["overwrite"],
+                config["rtc_input"]["pixel_format"],
+                config["rtc_input"]["duration_extension_ms"],
+                ffmpeg_threads,
+                gpu_slots,
+            )
+            for video, _, rtc_input_video, video_config_path in jobs
+        ]
+
+        # Collect in submission order to keep the video list sorted
+        for i, ((video, rel_path, _, video_config_path), future) in enumerate(
+            zip(jobs, futures)
+        ):
+            video_config = future.result()
+            if not video_config:
+                print(f"Error processing {video}")
+                executor.shutdown(cancel_futures=True)
+                break
+            # Serialize up front so the file is written in one call
+            with open(video_config_path, "w") as f:
+                f.write(json.dumps(video_config, indent=4))
+                print(
+                    f"Processed {i+1}/{len(video_files)}: {video} -> {video_config_path}"
+                )
 
-        video_id = os.path.relpath(rel_path, start=config["source"]["dataset_name"])
+            video_id = os.path.relpath(rel_path, start=config["source"]["dataset_name"])
 
-        generated_videos.append(video_id)
+            generated_videos.append(video_id)
 
     # Log down the lists of videos generated
     with open(config["rtc_input"]["videos"], "w") as f:
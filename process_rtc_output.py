@@ -2,19 +2,58 @@ import argparse
 import av
 import os
 import csv
+import mmap
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import List
 import re
-import code
-import json
 import yaml
 
+# One alternation so the log is scanned once; groups 1-7 are the
+# AssembledFrame fields, groups 8-14 the Decoded frame fields
+FRAME_PATTERN = re.compile(
+    rb"AssembledFrame: First=(\d+) Last=(\d+) EncodedBufsz=(\d+) NumPktExp=(\d+) NumPktRecv=(\d+) NumNack=(\d+) MaxNack=(\d+)"
+    rb"|Decoded frame: ts=(\d+) us First=(\d+) Last=(\d+) qp=(\d+) w=(\d+) h=(\d+) type=(\w+)"
+)
+
+# CSV columns written by correlated_rows, in order
+HEADER = (
+    "frame_index",
+    "video_RelativeTime",
+    "video_time",
+    "video_pts",
+    "video_size",
+    "video_width",
+    "video_height",
+    "video_key_frame",
+    "video_pict_type",
+    "video_is_corrupt",
+    "sync_error",
+    "log_RelativeTime",
+    "log_ts",
+    "log_First",
+    "log_Last",
+    "log_qp",
+    "log_w",
+    "log_h",
+    "log_frameType",
+    "log_Assembled_First",
+    "log_Assembled_Last",
+    "log_Assembled_EncodedBufsz",
+    "log_Assembled_NumPktExp",
+    "log_Assembled_NumPktRecv",
+    "log_Assembled_NumNack",
+    "log_Assembled_MaxNack",
+)
+
 
 # Legacy function
 def parse_frames(video: str):
     frame_info = []
     container = av.open(video)
-    for frame in container.decode(video=0):
+    stream = container.streams.video[0]
+    stream.thread_type = "AUTO"
+    for frame in container.decode(stream):
         frame_info.append(
             [
                 frame.time,
@@ -30,26 +69,21 @@ def parse_frames(video: str):
 
 
 def parse_rtc_log(log_file: str):
-    assembled_pattern = re.compile(
-        r"AssembledFrame: First=(\d+) Last=(\d+) EncodedBufsz=(\d+) NumPktExp=(\d+) NumPktRecv=(\d+) NumNack=(\d+) MaxNack=(\d+)"
-    )
-    decoded_pattern = re.compile(
-        r"Decoded frame: ts=(\d+) us First=(\d+) Last=(\d+) qp=(\d+) w=(\d+) h=(\d+) type=(\w+)"
-    )
-
     assembled_frames = {}
     decoded_frames = []
 
-    with open(log_file, "r") as f:
-        for line in f:
-            a_match = assembled_pattern.search(line)
-            d_match = decoded_pattern.search(line)
-
-            if a_match:
+    # Scan the mapped log in one pass; only matching lines become objects
+    with open(log_file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        for match in FRAME_PATTERN.finditer(mm):
+            groups = match.groups()
+            if groups[0] is not None:
                 first, last, encoded_bufsz, num_exp, num_recv, num_nack, max_nack = (
-                    a_match.groups()
+                    groups[:7]
                 )
-                key = (int(first), int(last))
+                # Pack (First, Last) into one int; hashes cheaper than a tuple
+                key = (int(first) << 32) | int(last)
                 # keep the last assembled frame info for this key
                 assembled_frames[key] = {
                     "First": int(first),
@@ -61,9 +95,8 @@ def parse_rtc_log(log_file: str):
                     "MaxNack": int(max_nack),
                 }
 
-            elif d_match:
-                ts, first, last, qp, w, h, ftype = d_match.groups()
-                key = (int(first), int(last))
+            else:
+                ts, first, last, qp, w, h, ftype = groups[7:]
                 decoded_frames.append(
                     {
                         "RelativeTime": int(ts) / 1e6,
@@ -73,7 +106,7 @@ def parse_rtc_log(log_file: str):
                         "qp": int(qp),
                         "w": int(w),
                         "h": int(h),
-                        "frameType": ftype,
+                        "frameType": ftype.decode(),
                         # Defer join; logs may be out-of-order
                         "Assembled": None,
                     }
@@ -84,7 +117,9 @@ def parse_rtc_log(log_file: str):
 
     first_frame_time = decoded_frames[0]["RelativeTime"]
     for frame in decoded_frames:
-        frame["Assembled"] = assembled_frames.get((frame["First"], frame["Last"]), None)
+        frame["Assembled"] = assembled_frames.get(
+            (frame["First"] << 32) | frame["Last"], None
+        )
         frame["RelativeTime"] = frame["RelativeTime"] - first_frame_time
 
     print(
@@ -98,6 +133,9 @@ def parse_frame_dump(video: str):
     if not container.streams.video:
         return []
     stream = container.streams.video[0]
+    # Slice threading only; frame threading would delay decoded frames and
+    # break the one-frame-per-packet check below
+    stream.thread_type = "SLICE"
 
     frames_info = []
     first_time = None
@@ -138,17 +176,21 @@ def correlate_frames(frames_info, decoded_frames):
     unmatched_ivf = []
     unmatched_log = []
 
-    def is_match(ivf_item, log_item):
-        if log_item is None:
-            return False
-        assembled = log_item.get("Assembled")
-        if assembled is None:
-            return False
-        return (
-            ivf_item["width"] == log_item["w"]
-            and ivf_item["height"] == log_item["h"]
-            and ivf_item["size"] == assembled.get("EncodedBufsz")
+    # Precompute the (width, height, size) each side is matched on so the
+    # loop compares one tuple per pair instead of several dict lookups
+    ivf_keys = [(f["width"], f["height"], f["size"]) for f in frames_info]
+    log_keys = [
+        (
+            None
+            if f.get("Assembled") is None
+            else (f["w"], f["h"], f["Assembled"].get("EncodedBufsz"))
         )
+        for f in decoded_frames
+    ]
+
+    def is_match(ivf_index, log_index):
+        log_key = log_keys[log_index]
+        return log_key is not None and ivf_keys[ivf_index] == log_key
 
     i, j = 0, 0
     n, m = len(frames_info), len(decoded_frames)
@@ -156,7 +198,7 @@ def correlate_frames(frames_info, decoded_frames):
     # Two-pointer with one-frame resync lookahead
     while i < n and j < m:
         # Skip log frames with no assembled info
-        if decoded_frames[j].get("Assembled") is None:
+        if log_keys[j] is None:
             unmatched_log.append(
                 {
                     "log_index": j,
@@ -167,7 +209,7 @@ def correlate_frames(frames_info, decoded_frames):
             j += 1
             continue
 
-        if is_match(frames_info[i], decoded_frames[j]):
+        if is_match(i, j):
             correlated_frames.append(
                 {
                     "ivf_index": i,
@@ -186,12 +228,8 @@ def correlate_frames(frames_info, decoded_frames):
         # Try resync by skipping one IVF frame if next two align
         skip_ivf_realigns = (
             i + 1 < n
-            and is_match(frames_info[i + 1], decoded_frames[j])
-            and (
-                i + 2 < n
-                and j + 1 < m
-                and is_match(frames_info[i + 2], decoded_frames[j + 1])
-            )
+            and is_match(i + 1, j)
+            and (i + 2 < n and j + 1 < m and is_match(i + 2, j + 1))
         )
         if skip_ivf_realigns:
             sync_error = "extra_frame"
@@ -214,12 +252,8 @@ def correlate_frames(frames_info, decoded_frames):
         # Don't add to correlated frames
         skip_log_realigns = (
             j + 1 < m
-            and is_match(frames_info[i], decoded_frames[j + 1])
-            and (
-                i + 1 < n
-                and j + 2 < m
-                and is_match(frames_info[i + 1], decoded_frames[j + 2])
-            )
+            and is_match(i, j + 1)
+            and (i + 1 < n and j + 2 < m and is_match(i + 1, j + 2))
         )
         if skip_log_realigns:
             sync_error = "extra_log"
@@ -277,6 +311,124 @@ def correlate_frames(frames_info, decoded_frames):
     }
 
 
+# One CSV row per correlated frame, built as a flat tuple
+def correlated_rows(correlated_frames):
+    empty_log = (None,) * 8  # 8 log fields
+    for idx, frame in enumerate(correlated_frames):
+        ivf = frame["ivf"]
+        log = frame["log"]
+
+        # Handle empty log case (extra IVF frames)
+        if not log:
+            assembled = {}
+            log_data = empty_log
+        else:
+            assembled = log.get("Assembled", {})
+            log_data = (
+                log.get("RelativeTime"),
+                log.get("ts"),
+                log.get("First"),
+                log.get("Last"),
+                log.get("qp"),
+                log.get("w"),
+                log.get("h"),
+                log.get("frameType"),
+            )
+
+        yield (
+            idx,
+            ivf["RelativeTime"],
+            ivf["time"],
+            ivf["pts"],
+            ivf["size"],
+            ivf["width"],
+            ivf["height"],
+            ivf["key_frame"],
+            ivf["pict_type"],
+            ivf["is_corrupt"],
+            frame["sync_error"],
+            *log_data,
+            assembled.get("First"),
+            assembled.get("Last"),
+            assembled.get("EncodedBufsz"),
+            assembled.get("NumPktExp"),
+            assembled.get("NumPktRecv"),
+            assembled.get("NumNack"),
+            assembled.get("MaxNack"),
+        )
+
+
+def process_video_output(config: dict, video_id: str) -> str:
+    print(f"Processing {video_id}")
+
+    rtc_log_path = os.path.join(
+        config["rtc_output_dir"],
+        config["dataset_name"],
+        str(Path(video_id).with_suffix(".rtc.log")),
+    )
+
+    ivf_path = os.path.join(
+        config["rtc_output_dir"],
+        config["dataset_name"],
+        str(Path(video_id).with_suffix(".ivf")),
+    )
+
+    # Decode the frame dump in the background while the log is parsed;
+    # PyAV releases the GIL while decoding
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        frames_future = executor.submit(parse_frame_dump, ivf_path)
+        log_decoded_frames, log_assembled_frames = parse_rtc_log(rtc_log_path)
+        frames_info = frames_future.result()
+    result = correlate_frames(frames_info, log_decoded_frames)
+
+    # Name the video; summaries from parallel workers may interleave
+    print(f"\nCorrelation summary ({video_id}):")
+    print(f"  IVF frames: {len(frames_info)}")
+    print(f"  Log decoded frames: {len(log_decoded_frames)}")
+    print(f"  Output frames: {len(result['correlated_frames'])}")
+
+    # Breakdown unmatched by reason
+    ivf_reasons = Counter(u.get("reason") for u in result["unmatched_ivf"])
+    log_reasons = Counter(u.get("reason") for u in result["unmatched_log"])
+    ivf_extra = ivf_reasons["extra_frame"] + ivf_reasons["extra_frame_tail"]
+    ivf_mismatch = ivf_reasons["mismatch"]
+    log_extra = (
+        log_reasons["extra_log"]
+        + log_reasons["extra_log_tail"]
+        + log_reasons["extra_log_no_assembled"]
+    )
+    log_mismatch = log_reasons["mismatch"]
+
+    print(
+        f"  Sync errors IVF frames: {len(result['unmatched_ivf'])} (extra={ivf_extra}, mismatch={ivf_mismatch})"
+    )
+    print(
+        f"  Sync errors Log frames: {len(result['unmatched_log'])} (extra={log_extra}, mismatch={log_mismatch})"
+    )
+
+    # Save the results to a csv file
+    output_csv = os.path.join(
+        config["processed_rtc_dir"],
+        config["dataset_name"],
+        str(Path(video_id).with_suffix(".csv")),
+    )
+
+    # Create output directory if it doesn't exist
+    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
+
+    with open(output_csv, "w", newline="", buffering=1024 * 1024) as f:
+        writer = csv.writer(f)
+
+        # Write header
+        writer.writerow(HEADER)
+
+        # Write data rows
+        writer.writerows(correlated_rows(result["correlated_frames"]))
+
+    print(f"Saved correlated frames to: {output_csv}")
+    return output_csv
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate RTC input")
     parser.add_argument(
@@ -286,154 +438,22 @@ if __name__ == "__main__":
 
     # Load configuration
     with open(args.config, "r") as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
     with open(config["process_list"], "r") as f:
         video_lists = [line.strip() for line in f]
 
-    for video_id in video_lists:
-        print(f"Processing {video_id}")
-
-        rtc_log_path = os.path.join(
-            config["rtc_output_dir"],
-            config["dataset_name"],
-            video_id.replace(config["video_suffix"], ".rtc.log"),
-        )
-        os.makedirs(os.path.dirname(rtc_log_path), exist_ok=True)
-
-        ivf_path = os.path.join(
-            config["rtc_output_dir"],
-            config["dataset_name"],
-            video_id.replace(config["video_suffix"], ".ivf"),
-        )
-        os.makedirs(os.path.dirname(ivf_path), exist_ok=True)
-
-        log_decoded_frames, log_assembled_frames = parse_rtc_log(rtc_log_path)
-        frames_info = parse_frame_dump(ivf_path)
-        result = correlate_frames(frames_info, log_decoded_frames)
-
-        print("\nCorrelation summary:")
-        print(f"  IVF frames: {len(frames_info)}")
-        print(f"  Log decoded frames: {len(log_decoded_frames)}")
-        print(f"  Output frames: {len(result['correlated_frames'])}")
-
-        # Breakdown unmatched by reason
-        ivf_extra = sum(
-            1
-            for u in result["unmatched_ivf"]
-            if u.get("reason") in ("extra_frame", "extra_frame_tail")
-        )
-        ivf_mismatch = sum(
-            1 for u in result["unmatched_ivf"] if u.get("reason") == "mismatch"
-        )
-        log_extra = sum(
-            1
-            for u in result["unmatched_log"]
-            if u.get("reason")
-            in ("extra_log", "extra_log_tail", "extra_log_no_assembled")
-        )
-        log_mismatch = sum(
-            1 for u in result["unmatched_log"] if u.get("reason") == "mismatch"
-        )
-
-        print(
-            f"  Sync errors IVF frames: {len(result['unmatched_ivf'])} (extra={ivf_extra}, mismatch={ivf_mismatch})"
-        )
-        print(
-            f"  Sync errors Log frames: {len(result['unmatched_log'])} (extra={log_extra}, mismatch={log_mismatch})"
-        )
-
-        # Save the results to a csv file
-        output_csv = os.path.join(
-            config["processed_rtc_dir"],
-            config["dataset_name"],
-            video_id.replace(config["video_suffix"], ".csv"),
-        )
-
-        # Create output directory if it doesn't exist
-        os.makedirs(os.path.dirname(output_csv), exist_ok=True)
-
-        with open(output_csv, "w", newline="") as f:
-            writer = csv.writer(f)
-
-            # Write header
-            header = [
-                "frame_index",
-                "video_RelativeTime",
-                "video_time",
-                "video_pts",
-                "video_size",
-                "video_width",
-                "video_height",
-                "video_key_frame",
-                "video_pict_type",
-                "video_is_corrupt",
-                "sync_error",
-                "log_RelativeTime",
-                "log_ts",
-                "log_First",
-                "log_Last",
-                "log_qp",
-                "log_w",
-                "log_h",
-                "log_frameType",
-                "log_Assembled_First",
-                "log_Assembled_Last",
-                "log_Assembled_EncodedBufsz",
-                "log_Assembled_NumPktExp",
-                "log_Assembled_NumPktRecv",
-                "log_Assembled_NumNack",
-                "log_Assembled_MaxNack",
-            ]
-            writer.writerow(header)
-
-            # Write data rows
-            for idx, frame in enumerate(result["correlated_frames"]):
-                ivf = frame["ivf"]
-                log = frame["log"]
-
-                # Handle empty log case (extra IVF frames)
-                if not log:
-                    assembled = {}
-                    log_data = [None] * 8  # 8 log fields
-                else:
-                    assembled = log.get("Assembled", {})
-                    log_data = [
-                        log.get("RelativeTime"),
-                        log.get("ts"),
-                        log.get("First"),
-                        log.get("Last"),
-                        log.get("qp"),
-                        log.get("w"),
-                        log.get("h"),
-                        log.get("frameType"),
-                    ]
-
-                row = (
-                    [
-                        idx,
-                        ivf["RelativeTime"],
-                        ivf["time"],
-                        ivf["pts"],
-                        ivf["size"],
-                        ivf["width"],
-                        ivf["height"],
-                        ivf["key_frame"],
-                        ivf["pict_type"],
-                        ivf["is_corrupt"],
-                        frame["sync_error"],
-                    ]
-                    + log_data
-                    + [
-                        assembled.get("First"),
-                        assembled.get("Last"),
-                        assembled.get("EncodedBufsz"),
-                        assembled.get("NumPktExp"),
-                        assembled.get("NumPktRecv"),
-                        assembled.get("NumNack"),
-                        assembled.get("MaxNack"),
-                    ]
-                )
-                writer.writerow(row)
-
-        print(f"Saved correlated frames to: {output_csv}")
+    # Videos are independent; half the cores since each decode is threaded
+    max_workers = max(1, (os.cpu_count() or 1) // 2)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(process_video_output, config, video_id)
+            for video_id in video_lists
+        ]
+
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                executor.shutdown(cancel_futures=True)
+                raise
@@ -20,24 +20,51 @@ Options:
 """
 
 import argparse
-import random
+import os
 import sys
-import math
+from collections import Counter
 from pathlib import Path
+import numpy as np
+
+# Dataset categories, identified by a directory component in the file path
+CATEGORIES = ("Celeb-real", "Celeb-synthesis", "YouTube-real")
+CATEGORY_SET = frozenset(CATEGORIES)
+
+
+def classify_file(file_path):
+    """Return the category of a file path, or None if it has none."""
+    # Probe the directory components; the file name itself never counts
+    for segment in file_path.split("/")[:-1]:
+        if segment in CATEGORY_SET:
+            return segment
+    return None
+
+
+def parse_categories(value):
+    """Parse --categories into a validated frozenset, or None for all."""
+    if value.lower() == "all":
+        return None
+    categories = frozenset(cat.strip() for cat in value.split(","))
+    # TODO: Currently hard-coded categories
+    invalid_categories = categories - CATEGORY_SET
+    if invalid_categories:
+        raise argparse.ArgumentTypeError(
+            f"Invalid categories: {', '.join(sorted(invalid_categories))}. "
+            f"Valid categories: {', '.join(CATEGORIES)}"
+        )
+    return categories
 
 
 def read_file_list(input_file):
-    """Read the list of files from the input file."""
-    try:
-        with open(input_file, "r") as f:
-            files = [line.strip() for line in f if line.strip()]
-        return files
-    except FileNotFoundError:
-        print(f"Error: Input file '{input_file}' not found.")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error reading file '{input_file}': {e}")
-        sys.exit(1)
+    """Read the list of files from the input file as (path, category) pairs."""
+    # One read and split instead of iterating the file line by line
+    with open(input_file, "r") as f:
+        lines = f.read().splitlines()
+    return [
+        (file_path, classify_file(file_path))
+        for file_path in map(str.strip, lines)
+        if file_path
+    ]
 
 
 def filter_by_categories(files, categories):
@@ -45,33 +72,16 @@ def filter_by_categories(files, categories):
     if not categories or "all" in categories:
         return files
 
-    filtered_files = []
-    for file_path in files:
-        for category in categories:
-            if f"/{category}/" in file_path:
-                filtered_files.append(file_path)
-                break
-
-    return filtered_files
-
+    return [entry for entry in files if entry[1] in categories]
 
-def shuffle_files(files, seed=None):
-    """Randomly shuffle the list of files."""
-    if seed is not None:
-        random.seed(seed)
 
-    shuffled_files = files.copy()
-    random.shuffle(shuffled_files)
-    return shuffled_files
-
-
-def split_into_batches(files, batch_size):
-    """Split files into batches of specified size."""
-    batches = []
-    for i in range(0, len(files), batch_size):
-        batch = files[i : i + batch_size]
-        batches.append(batch)
-    return batches
+def iter_batches(files, batch_size, seed=None):
+    """Yield randomly shuffled batches of files of the specified size."""
+    # Slice the permuted indices directly instead of building a shuffled copy
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(files)).tolist()
+    for i in range(0, len(order), batch_size):
+        yield [files[j] for j in order[i : i + batch_size]]
 
 
 def save_batches(batches, output_prefix, output_dir):
@@ -79,14 +89,15 @@ def save_batches(batches, output_prefix, output_dir):
     batch_files = []
     try:
         # Create output directory if it doesn't exist
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        out_dir = os.fspath(Path(output_dir))
+        os.makedirs(out_dir, exist_ok=True)
 
         for i, batch in enumerate(batches):
-            batch_file = Path(output_dir) / f"{output_prefix}{i+1:03d}.txt"
+            batch_file = os.path.join(out_dir, f"{output_prefix}{i+1:03d}.txt")
+            # Join in C and write each batch file in one call
             with open(batch_file, "w") as f:
-                for file_path in batch:
-                    f.write(file_path + "\n")
-            batch_files.append(str(batch_file))
+                f.write("\n".join(file_path for file_path, _ in batch) + "\n")
+            batch_files.append(batch_file)
             print(f"Batch {i+1}: {len(batch)} files saved to '{batch_file}'")
         return batch_files
     except Exception as e:
@@ -96,7 +107,15 @@ def save_batches(batches, output_prefix, output_dir):
 
 def print_batch_statistics(files, batches, categories):
     """Print statistics about the batch splitting."""
-    total_files = sum(len(batch) for batch in batches)
+    # Gather sizes and category counts in a single pass over the batches
+    batch_sizes = []
+    category_counts = Counter()
+    for batch in batches:
+        batch_sizes.append(len(batch))
+        category_counts.update(category for _, category in batch)
+    category_counts.pop(None, None)
+    total_files = sum(batch_sizes)
+
     print(f"\nBatch Statistics:")
     print(f"Total files available: {len(files)}")
     print(f"Files distributed: {total_files}")
@@ -104,30 +123,15 @@ def print_batch_statistics(files, batches, categories):
     print(f"Average files per batch: {total_files / len(batches):.1f}")
 
     if categories and "all" not in categories:
-        print(f"Categories filtered: {', '.join(categories)}")
-
-    # Count by category across all batches
-    category_counts = {}
-    for batch in batches:
-        for file_path in batch:
-            if "/Celeb-real/" in file_path:
-                category_counts["Celeb-real"] = category_counts.get("Celeb-real", 0) + 1
-            elif "/Celeb-synthesis/" in file_path:
-                category_counts["Celeb-synthesis"] = (
-                    category_counts.get("Celeb-synthesis", 0) + 1
-                )
-            elif "/YouTube-real/" in file_path:
-                category_counts["YouTube-real"] = (
-                    category_counts.get("YouTube-real", 0) + 1
-                )
+        print(f"Categories filtered: {', '.join(sorted(categories))}")
 
     print(f"\nDistribution breakdown by category:")
     for category, count in sorted(category_counts.items()):
         print(f"  {category}: {count} files")
 
     print(f"\nBatch sizes:")
-    for i, batch in enumerate(batches):
-        print(f"  Batch {i+1}: {len(batch)} files")
+    for i, batch_size in enumerate(batch_sizes):
+        print(f"  Batch {i+1}: {batch_size} files")
 
 
 def main():
@@ -177,29 +181,28 @@ def main():
     parser.add_argument(
         "--categories",
         "-c",
+        type=parse_categories,
         default="all",
         help="Comma-separated list of categories to include (default: all). ",
     )
 
     args = parser.parse_args()
 
-    # Parse categories
-    if args.categories.lower() == "all":
-        categories = None
-    else:
-        categories = [cat.strip() for cat in args.categories.split(",")]
-        # TODO: Currently hard-coded categories
-        valid_categories = {"Celeb-real", "Celeb-synthesis", "YouTube-real"}
-        invalid_categories = set(categories) - valid_categories
-        if invalid_categories:
-            print(f"Error: Invalid categories: {invalid_categories}")
-            print(f"Valid categories: {', '.join(valid_categories)}")
-            sys.exit(1)
+    categories = args.categories
 
     print(f"Reading files from: {args.input_file}")
-    files = read_file_list(args.input_file)
+    try:
+        files = read_file_list(args.input_file)
+    except FileNotFoundError:
+        print(f"Error: Input file '{args.input_file}' not found.")
+        sys.exit(1)
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Error reading file '{args.input_file}': {e}")
+        sys.exit(1)
 
-    print(f"Filtering by categories: {categories if categories else 'all'}")
+    print(
+        f"Filtering by categories: {', '.join(sorted(categories)) if categories else 'all'}"
+    )
     filtered_files = filter_by_categories(files, categories)
 
     if not filtered_files:
@@ -207,10 +210,9 @@ def main():
         sys.exit(1)
 
     print(f"Randomly shuffling {len(filtered_files)} files (seed: {args.seed})")
-    shuffled_files = shuffle_files(filtered_files, args.seed)
-
     print(f"Splitting into batches of size {args.batch_size}")
-    batches = split_into_batches(shuffled_files, args.batch_size)
+    # Kept as a list; the statistics below need every batch
+    batches = list(iter_batches(filtered_files, args.batch_size, args.seed))
 
     batch_files = save_batches(batches, args.output_prefix, args.output_dir)
     print_batch_statistics(files, batches, categories)
@@ -221,7 +223,7 @@ def main():
 
     print(f"\nFirst batch preview (batch_001.txt):")
     if batches:
-        for i, file_path in enumerate(batches[0][:5]):
+        for i, (file_path, _) in enumerate(batches[0][:5]):
             print(f"  {i+1:2d}. {file_path}")
         if len(batches[0]) > 5:
             print(f"  ... and {len(batches[0]) - 5} more files in this batch")
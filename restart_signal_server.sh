@@ -3,6 +3,7 @@ set -euo pipefail
 
 REMOTE_BASE="$1"
 PORT="$2"
+LOG_NAME="${3:-server.log}" # one log per server when several run at once
 
 # Kill any existing peerconnection_server running on this port
 # Using lsof to find processes listening on the port
@@ -13,5 +14,5 @@ if [ -n "$pids" ]; then
 fi
 
 # Start server in background, detached from terminal
-nohup "$REMOTE_BASE/peerconnection_server" --port="$PORT" >"$REMOTE_BASE/server.log" 2>&1 &
+nohup "$REMOTE_BASE/peerconnection_server" --port="$PORT" >"$REMOTE_BASE/$LOG_NAME" 2>&1 &
 echo "peerconnection_server restarted on port $PORT (pid=$!)"
@@ -1,22 +1,40 @@
 import asyncio
 import asyncssh
 import os
-import json
+from pathlib import Path
 import argparse
 import time
 import yaml
 
-LOCAL_CMD = "./peerconnection_client --server={signal_server} --port={signal_port} --autoconnect --autocall --config={config} 2>local_last_run.log"
+LOCAL_CMD = "./peerconnection_client --server={signal_server} --port={signal_port} --autoconnect --autocall --config={config} 2>{local_log}"
 REMOTE_CMD = '{remote_base}/peerconnection_client --server={signal_server} --port={signal_port} --autoconnect --force_fieldtrials="WebRTC-DecoderDataDumpDirectory/{masked_dump_dir}/"'
 
+SSH_KEEPALIVE_INTERVAL = 30
+SSH_CONNECT_ATTEMPTS = 5
 
-async def restart_signal_server(remote_host, remote_base_dir, signal_server_port):
+
+async def connect_remote(remote_host):
+    """Open the SSH connection shared by all tests, backing off on failure"""
+    backoff = 1
+    for attempt in range(1, SSH_CONNECT_ATTEMPTS + 1):
+        try:
+            return await asyncssh.connect(
+                remote_host, keepalive_interval=SSH_KEEPALIVE_INTERVAL
+            )
+        except (OSError, asyncssh.Error) as e:
+            if attempt == SSH_CONNECT_ATTEMPTS:
+                raise
+            print(f"=== SSH connect failed ({e}) - retrying in {backoff}s")
+            await asyncio.sleep(backoff)
+            backoff *= 2
+
+
+async def restart_signal_server(conn, remote_base_dir, signal_server_port, log_name):
     try:
-        async with asyncssh.connect(remote_host) as conn:
-            restart_cmd = f"{remote_base_dir}/restart_signal_server.sh {remote_base_dir} {signal_server_port}"
-            restart_result = await conn.run(restart_cmd, check=False)
-            print(restart_result.stdout, restart_result.stderr)
-            return restart_result.exit_status
+        restart_cmd = f"{remote_base_dir}/restart_signal_server.sh {remote_base_dir} {signal_server_port} {log_name}"
+        restart_result = await conn.run(restart_cmd, check=False)
+        print(restart_result.stdout, restart_result.stderr)
+        return restart_result.exit_status
     except Exception as e:
         print(f"Error: asyncio run failed: {e}")
         await asyncio.sleep(2)
@@ -24,68 +42,49 @@ async def restart_signal_server(remote_host, remote_base_dir, signal_server_port
 
 
 async def run_one_pc(
-    remote_host,
+    conn,
     remote_base_dir,
-    signal_server,
-    signal_port,
+    remote_cmd_template,
+    local_cmd_template,
     local_config,
     local_env_vars,
     remote_env_vars,
     remote_output,
-    collect_output,
+    rtc_log,
+    dump_dir,
 ):
     try:
-        async with asyncssh.connect(remote_host) as conn:
-            masked_output_dir = os.path.dirname(remote_output).replace("/", ";")
-            rtc_log = remote_output.replace(".ivf", ".rtc.log")
-            remote_cmd = REMOTE_CMD.format(
-                remote_base=remote_base_dir,
-                signal_server=signal_server,
-                signal_port=signal_port,
-                masked_dump_dir=masked_output_dir,
-            )
-            local_cmd = LOCAL_CMD.format(
-                signal_server=signal_server,
-                signal_port=signal_port,
-                config=local_config,
-            )
-            print(f"\n=== Remote: {remote_cmd}")
-            print(f"=== Local: {local_cmd}")
+        # The templates already hold config values, which may contain braces,
+        # so the per-test fields are substituted literally rather than formatted
+        masked_output_dir = dump_dir.replace("/", ";")
+        remote_cmd = remote_cmd_template.replace("{masked_dump_dir}", masked_output_dir)
+        local_cmd = local_cmd_template.replace("{config}", local_config)
+        print(f"\n=== Remote: {remote_cmd}")
+        print(f"=== Local: {local_cmd}")
 
-            remote_proc = await conn.create_process(
-                f"bash -lc '{remote_cmd} 2>{rtc_log}'",
-                env=remote_env_vars,
-            )
+        remote_proc = await conn.create_process(
+            f"bash -lc 'mkdir -p {dump_dir} && {remote_cmd} 2>{rtc_log}'",
+            env=remote_env_vars,
+        )
 
-            local_proc = await asyncio.create_subprocess_shell(
-                local_cmd,
-                env=local_env_vars,
-            )
-            local_ret = await local_proc.wait()
-            remote_result = await remote_proc.wait()
-            print(
-                f"=== Clients return: local={local_ret}, remote={remote_result.exit_status}"
-            )
+        local_proc = await asyncio.create_subprocess_shell(
+            local_cmd,
+            env=local_env_vars,
+        )
+        local_ret = await local_proc.wait()
+        remote_result = await remote_proc.wait()
+        print(
+            f"=== Clients return: local={local_ret}, remote={remote_result.exit_status}"
+        )
+
+        cleanup_cmd = f"{remote_base_dir}/recv_cleanup.sh {dump_dir} {remote_output}"
+        result = await conn.run(cleanup_cmd, check=False)
+        if result.exit_status != 0:
+            print(f"=== Cleanup error: {result.stderr}")
+        else:
+            print("===", result.stdout)
 
-            cleanup_cmd = f"{remote_base_dir}/recv_cleanup.sh {os.path.dirname(remote_output)} {remote_output}"
-            result = await conn.run(cleanup_cmd, check=False)
-            if result.exit_status != 0:
-                print(f"=== Cleanup error: {result.stderr}")
-            else:
-                print("===", result.stdout)
-                if collect_output:
-                    log_path = remote_output.replace(".ivf", ".rtc.log")
-                    print(f"=== Collecting output: {remote_output}, {log_path}")
-                    async with conn.start_sftp_client() as sftp:
-                        os.makedirs(os.path.dirname(remote_output), exist_ok=True)
-                        sftp_video = await sftp.get(remote_output, remote_output)
-                        sftp_log = await sftp.get(log_path, log_path)
-                        if sftp_video.exit_status != 0 or sftp_log.exit_status != 0:
-                            print(
-                                f"=== SFTP error: {sftp_video.stderr}, {sftp_log.stderr}"
-                            )
-
-            return local_ret or remote_result.exit_status or result.exit_status
+        return local_ret or remote_result.exit_status or result.exit_status
 
     except Exception as e:
         print(f"\n=== Error: asyncio run failed: {e}")
@@ -93,6 +92,20 @@ async def run_one_pc(
         return 1
 
 
+async def collect_output(sftp, remote_output, log_path):
+    print(f"=== Collecting output: {remote_output}, {log_path}")
+    try:
+        os.makedirs(os.path.dirname(remote_output), exist_ok=True)
+        # Both files come over the same SFTP session; fetch them together
+        await asyncio.gather(
+            sftp.get(remote_output, remote_output), sftp.get(log_path, log_path)
+        )
+        return True
+    except (OSError, asyncssh.Error) as e:
+        print(f"=== SFTP error: {remote_output}: {e}")
+        return False
+
+
 async def orchestrate(config):
     run_start_time = time.time()
     rtc_cfg = config["rtc_stream"]
@@ -106,77 +119,178 @@ async def orchestrate(config):
     local_env["DISPLAY"] = f":{local_display}"
     remote_env = {"DISPLAY": f":{remote_display}"}
 
-    print(
-        f"\n=== Starting up signal server at {rtc_cfg["signal_server"]}:{rtc_cfg["signal_port"]}"
-    )
-    await restart_signal_server(
-        rtc_cfg["remote_host"], rtc_cfg["remote_base_dir"], rtc_cfg["signal_port"]
-    )
+    # One SSH connection is shared by every test and signal server restart,
+    # and one SFTP session by every download
+    conn = await connect_remote(rtc_cfg["remote_host"])
+    sftp = await conn.start_sftp_client() if rtc_cfg["collect_output"] else None
+    reconnect_lock = asyncio.Lock()
+
+    # Each slot streams one video at a time through its own signal server
+    slots = rtc_cfg.get("slots", 1)
+    base_port = int(rtc_cfg["signal_port"])
+    # Slot 0 keeps the original server log name; others get their own
+    server_logs = [
+        f"server.slot{slot}.log" if slot else "server.log" for slot in range(slots)
+    ]
+    for slot in range(slots):
+        print(
+            f"\n=== Starting up signal server at {rtc_cfg["signal_server"]}:{base_port + slot}"
+        )
+        await restart_signal_server(
+            conn, rtc_cfg["remote_base_dir"], base_port + slot, server_logs[slot]
+        )
 
-    idx = rtc_cfg["start_idx"]
-    delay = rtc_cfg["delay"]
-    attempt = 0
     total_attempts = 0
     skipped = []
+    collect_tasks = []
+    # Shared by all slots; a free slot takes the next video
+    pending = iter(range(rtc_cfg["start_idx"], len(video_lists)))
 
-    file_start_time = time.time()
-    while idx < len(video_lists):
-        print(f"\n=== Test {idx}/{len(video_lists)}")
-        video_id = video_lists[idx]
-        video_config_file = os.path.join(
-            config["rtc_input"]["dir"],
-            config["source"]["dataset"],
-            video_id.replace(config["source"]["video_suffix"], ".json"),
-        )
+    async def reconnect_if_lost(failed_conn):
+        """Replace the shared connection if the one a test ran on dropped.
 
-        output_path = os.path.join(
-            rtc_cfg["remote_base_dir"],
-            rtc_cfg["dir"],
-            config["source"]["dataset"],
-            video_id.replace(config["source"]["video_suffix"], ".ivf"),
-        )
+        Returns whether failed_conn has been replaced, here or by another slot.
+        """
+        nonlocal conn, sftp
+        async with reconnect_lock:
+            # Another slot may have reconnected already
+            if conn is not failed_conn:
+                return True
+            try:
+                await conn.run("true", check=True)
+                return False
+            except (OSError, asyncssh.Error) as e:
+                print(f"=== SSH connection lost ({e}) - reconnecting")
+            # Downloads still running on the dead session fail and are
+            # retried by collect over the new one
+            if sftp:
+                sftp.exit()
+            conn.close()
+            conn = await connect_remote(rtc_cfg["remote_host"])
+            if sftp:
+                sftp = await conn.start_sftp_client()
+            return True
+
+    async def collect(remote_output, log_path):
+        """Download a test's output, again over a new session if the connection drops"""
+        while True:
+            # Taken under the lock so a reconnect in progress finishes first
+            async with reconnect_lock:
+                collect_conn, collect_sftp = conn, sftp
+            if await collect_output(collect_sftp, remote_output, log_path):
+                return
+            if not await reconnect_if_lost(collect_conn):
+                return
+
+    async def run_slot(slot):
+        nonlocal total_attempts
+        signal_port = base_port + slot
+        # Slot 0 keeps the original dump dir and log; others get their own so
+        # recv_cleanup.sh never sees another slot's dump
+        local_log = f"local_last_run.slot{slot}.log" if slot else "local_last_run.log"
 
-        async_result = await run_one_pc(
-            remote_host=rtc_cfg["remote_host"],
-            remote_base_dir=rtc_cfg["remote_base_dir"],
+        # Fill in what is fixed for the slot; only the dump dir and the input
+        # config change between tests
+        remote_cmd_template = REMOTE_CMD.format(
+            remote_base=rtc_cfg["remote_base_dir"],
             signal_server=rtc_cfg["signal_server"],
-            signal_port=rtc_cfg["signal_port"],
-            local_config=video_config_file,
-            local_env_vars=local_env,
-            remote_env_vars=remote_env,
-            remote_output=output_path,
-            collect_output=rtc_cfg["collect_output"],
+            signal_port=signal_port,
+            masked_dump_dir="{masked_dump_dir}",
         )
+        local_cmd_template = LOCAL_CMD.format(
+            signal_server=rtc_cfg["signal_server"],
+            signal_port=signal_port,
+            config="{config}",
+            local_log=local_log,
+        )
+
+        # The slot's last download; it may only overlap the inter-test delay
+        download = None
+
+        file_start_time = time.time()
+        for idx in pending:
+            # Finish the previous download before streaming again, so the
+            # transfer never competes with the measured stream on the link
+            if download:
+                await download
+                download = None
+
+            video_id = video_lists[idx]
+            video_config_file = os.path.join(
+                config["rtc_input"]["dir"],
+                config["source"]["dataset"],
+                str(Path(video_id).with_suffix(".json")),
+            )
+
+            output_path = os.path.join(
+                rtc_cfg["remote_base_dir"],
+                rtc_cfg["dir"],
+                config["source"]["dataset"],
+                str(Path(video_id).with_suffix(".ivf")),
+            )
+            # Derived once so the test and the download agree on the names
+            rtc_log = str(Path(output_path).with_suffix(".rtc.log"))
+            dump_dir = os.path.dirname(output_path)
+            if slot:
+                dump_dir = os.path.join(dump_dir, f"slot{slot}")
+
+            delay = rtc_cfg["delay"]
+            attempt = 0
+            while True:
+                print(f"\n=== Test {idx}/{len(video_lists)} (slot {slot})")
+                test_conn = conn
+                async_result = await run_one_pc(
+                    conn=test_conn,
+                    remote_base_dir=rtc_cfg["remote_base_dir"],
+                    remote_cmd_template=remote_cmd_template,
+                    local_cmd_template=local_cmd_template,
+                    local_config=video_config_file,
+                    local_env_vars=local_env,
+                    remote_env_vars=remote_env,
+                    remote_output=output_path,
+                    rtc_log=rtc_log,
+                    dump_dir=dump_dir,
+                )
+
+                if async_result == 0:
+                    if rtc_cfg["collect_output"]:
+                        # Download in the background during the delay
+                        download = asyncio.create_task(collect(output_path, rtc_log))
+                        collect_tasks.append(download)
+                    break
+
+                attempt += 1
+                total_attempts += 1
+                if attempt > rtc_cfg["max_retry"]:
+                    print(f"[WARNING] Maximum retries reached - Skipping")
+                    skipped.append(video_id)
+                    break
 
-        if async_result != 0:
-            attempt += 1
-            total_attempts += 1
-            if attempt > rtc_cfg["max_retry"]:
-                print(f"[WARNING] Maximum retries reached - Skipping")
-                skipped.append(video_id)
-            else:
                 # Retry
                 print(f"[WARNING] Return code non-zero - Retrying {attempt} times")
                 delay = round(delay * rtc_cfg["delay_factor"])
+                # A dropped connection surfaces as a failed test; reconnect
+                await reconnect_if_lost(test_conn)
                 await restart_signal_server(
-                    rtc_cfg["remote_host"],
-                    rtc_cfg["remote_base_dir"],
-                    rtc_cfg["signal_port"],
+                    conn, rtc_cfg["remote_base_dir"], signal_port, server_logs[slot]
                 )
                 print(
-                    f"Signal server restarted {rtc_cfg["signal_server"]}:{rtc_cfg["signal_port"]}"
+                    f"Signal server restarted {rtc_cfg["signal_server"]}:{signal_port}"
                 )
-                continue
 
-        # Next file
-        idx += 1
-        attempt = 0
-        delay = rtc_cfg["delay"]
-        print(f"=== File time: {time.time() - file_start_time}s")
-        file_start_time = time.time()
+            # Next file
+            delay = rtc_cfg["delay"]
+            print(f"=== File time: {time.time() - file_start_time}s")
+            file_start_time = time.time()
+
+            print(f"\n>>> Waiting for {delay} seconds...")
+            await asyncio.sleep(delay)
 
-        print(f"\n>>> Waiting for {delay} seconds...")
-        await asyncio.sleep(delay)
+    await asyncio.gather(*(run_slot(slot) for slot in range(slots)))
+    await asyncio.gather(*collect_tasks)
+    if sftp:
+        sftp.exit()
+    conn.close()
     # Done
     print("\n=== Orchestration Complete")
     print(
@@ -195,6 +309,6 @@ if __name__ == "__main__":
 
     # Load configuration
     with open(args.config, "r") as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
     asyncio.run(orchestrate(config))
@@ -1,133 +1,193 @@
 #! /usr/bin/env python3
 
 import argparse
-import code
+import bisect
 import os
-import sys
 import csv
 import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
 import numpy as np
+import matplotlib
+
+# Render off-screen; figures are only ever written to files
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+from PIL import Image
 import yaml
 
+# Let Agg simplify and chunk dense line paths
+plt.rcParams.update(
+    {"path.simplify": True, "path.simplify_threshold": 1.0, "agg.path.chunksize": 10000}
+)
+
+# CSV columns read by load_frame_data, in the order they are unpacked
+FRAME_COLUMNS = (
+    "frame_index",
+    "video_RelativeTime",
+    "video_width",
+    "video_height",
+    "video_size",
+    "log_qp",
+    "log_Assembled_NumPktExp",
+    "log_Assembled_NumNack",
+)
+
+
+# Sliding window parameters for the bitrate
+BITRATE_WINDOW = 1.0  # 1 second window
+BITRATE_LOOKBACK = 100  # look back up to 100 frames
+BITRATE_MIN_FRAMES = 2  # minimum frames needed for bitrate calculation
+
+
+def sliding_bitrate(ts, sizes):
+    """Calculate the bitrate in kbps over the window ending at each frame (timestamps sorted)."""
+    # Window sums come from the cumulative bytes
+    cum_bytes = np.concatenate(([0], np.cumsum(sizes)))
+
+    # Each window starts at its earliest frame within both limits
+    positions = np.arange(len(ts))
+    starts = np.maximum(
+        np.searchsorted(ts, ts - BITRATE_WINDOW, side="left"),
+        positions - BITRATE_LOOKBACK,
+    )
+    total_bytes = cum_bytes[positions + 1] - cum_bytes[starts]
+    time_span = ts - ts[starts]
+
+    # Bitrate (kbps) where the window has enough frames and a time span
+    bitrate = np.zeros(len(ts))
+    valid = (positions - starts + 1 >= BITRATE_MIN_FRAMES) & (time_span > 0)
+    bitrate[valid] = total_bytes[valid] * 8 / time_span[valid] / 1000
+    return bitrate
+
+
+def load_frame_data(frame_summary_path, frame_ids=None):
+    """Load frame data from CSV file including timestamps, resolutions, sizes, QP values, and bitrate.
 
-def load_frame_data(frame_summary_path):
-    """Load frame data from CSV file including timestamps, resolutions, sizes, QP values, and bitrate."""
+    Returns a dict of equal-length arrays, one per field, sorted by timestamp.
+    If frame_ids is given, only those frames and the frames their bitrate
+    window reaches back to are kept.
+    """
     frame_data_csv = {}
     if os.path.exists(frame_summary_path):
         with open(frame_summary_path, "r") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                try:
-                    frame_index = int(row["frame_index"])
-                    timestamp = float(row["video_RelativeTime"])
-                    width = int(row["video_width"])
-                    height = int(row["video_height"])
-                    size = int(row["video_size"])
-                    log_qp = float(row["log_qp"])
-                    log_assembled_numpktexp = float(row["log_Assembled_NumPktExp"])
-                    log_assembled_numnack = float(row["log_Assembled_NumNack"])
-                    frame_data_csv[frame_index] = {
-                        "timestamp": timestamp,
-                        "width": width,
-                        "height": height,
-                        "resolution": f"{width}x{height}",
-                        "size": size,
-                        "log_qp": log_qp,
-                        "log_assembled_numpktexp": log_assembled_numpktexp,
-                        "log_assembled_numnack": log_assembled_numnack,
-                    }
-                except (ValueError, KeyError):
-                    continue
-
-    # Calculate bitrate using sliding window for all frames
-    if frame_data_csv:
-        # Sort frames by timestamp first
-        sorted_frames = sorted(frame_data_csv.items(), key=lambda x: x[1]["timestamp"])
-
-        # Sliding window parameters
-        window_duration = 1.0  # 1 second window
-        min_frames_in_window = 2  # minimum frames needed for bitrate calculation
-
-        for i, (frame_id, frame_data) in enumerate(sorted_frames):
-            # Find frames within the time window
-            current_time = frame_data["timestamp"]
-            window_start_time = current_time - window_duration
-
-            # Collect frames in the window
-            window_frames = []
-            for j in range(max(0, i - 100), i + 1):  # Look back up to 100 frames
-                j_frame_id, j_frame_data = sorted_frames[j]
-                if j_frame_data["timestamp"] >= window_start_time:
-                    window_frames.append((j_frame_id, j_frame_data))
-
-            # Calculate bitrate if we have enough frames
-            if len(window_frames) >= min_frames_in_window:
-                # Calculate total bytes in window
-                total_bytes = sum(frame_data["size"] for _, frame_data in window_frames)
-
-                # Calculate time span of window
-                time_span = (
-                    window_frames[-1][1]["timestamp"] - window_frames[0][1]["timestamp"]
+            header = next(csv.reader([csvfile.readline()]))
+            rows = csvfile.readlines()
+        if rows and all(name in header for name in FRAME_COLUMNS):
+            # Parse the needed columns as text with numpy's C reader, then drop
+            # frames with missing fields (e.g. no matching log entry)
+            columns = np.loadtxt(
+                rows,
+                dtype=str,
+                delimiter=",",
+                quotechar='"',
+                usecols=[header.index(name) for name in FRAME_COLUMNS],
+                ndmin=2,
+                unpack=True,
+            )
+            columns = columns[:, np.all(columns != "", axis=0)]
+            frame_indices, timestamps, widths, heights, sizes = (
+                columns[0].astype(np.int64),
+                columns[1].astype(np.float64),
+                columns[2].astype(np.int64),
+                columns[3].astype(np.int64),
+                columns[4].astype(np.int64),
+            )
+            log_qps, log_numpktexps, log_numnacks = columns[5:].astype(np.float64)
+
+            frame_data_csv = {
+                "frame_index": frame_indices,
+                "timestamp": timestamps,
+                "width": widths,
+                "height": heights,
+                "size": sizes,
+                "log_qp": log_qps,
+                "log_assembled_numpktexp": log_numpktexps,
+                "log_assembled_numnack": log_numnacks,
+            }
+
+            # Timestamp order serves both the bitrate window and the plots
+            order = np.argsort(timestamps, kind="stable")
+            frame_data_csv = {
+                name: column[order] for name, column in frame_data_csv.items()
+            }
+
+            if frame_ids is not None:
+                # Keep each requested frame and the BITRATE_LOOKBACK frames
+                # before it, which is as far back as its bitrate window reaches
+                needed = np.isin(frame_data_csv["frame_index"], list(frame_ids))
+                needed_count = np.concatenate(([0], np.cumsum(needed)))
+                window_end = np.minimum(
+                    np.arange(len(needed)) + BITRATE_LOOKBACK + 1, len(needed)
                 )
-
-                # Calculate bitrate (bits per second)
-                if time_span > 0:
-                    bitrate_bps = (total_bytes * 8) / time_span  # Convert bytes to bits
-                    bitrate_kbps = bitrate_bps / 1000  # Convert to kbps
-                    frame_data_csv[frame_id]["bitrate"] = bitrate_kbps
-                else:
-                    frame_data_csv[frame_id]["bitrate"] = 0
-            else:
-                frame_data_csv[frame_id]["bitrate"] = 0
+                keep = needed_count[window_end] > needed_count[:-1]
+                frame_data_csv = {
+                    name: column[keep] for name, column in frame_data_csv.items()
+                }
+
+            frame_data_csv["resolution"] = np.char.add(
+                np.char.add(frame_data_csv["width"].astype(str), "x"),
+                frame_data_csv["height"].astype(str),
+            )
+            frame_data_csv["bitrate"] = sliding_bitrate(
+                frame_data_csv["timestamp"], frame_data_csv["size"]
+            )
 
     return frame_data_csv
 
 
-def correlate_frame_data(frames_data, frame_data_csv):
-    """Correlate detector predictions with frame data.
-
-    Args:
-        frames_data: Detector prediction data for frames
-        frame_data_csv: Frame metadata (timestamps, resolutions, sizes, QP, NACK, bitrate)
-
-    Returns:
-        Dictionary of frame predictions with correlated data, or None if no data
-    """
-    frame_predictions = {}
+def parse_predictions(frames_data):
+    """Map frame numbers to detector predictions, skipping frames without one."""
+    predictions = {}
     for frame_id, frame_data in frames_data.items():
         if "pred" in frame_data:
             try:
-                frame_num = int(frame_id)
-                if frame_num in frame_data_csv:
-                    csv_data = frame_data_csv[frame_num]
-                    frame_predictions[frame_num] = {
-                        "pred": frame_data["pred"],
-                        "timestamp": csv_data["timestamp"],
-                        "width": csv_data["width"],
-                        "height": csv_data["height"],
-                        "resolution": csv_data["resolution"],
-                        "size": csv_data["size"],
-                        "qp": csv_data["log_qp"],
-                        "assembled_numpktexp": csv_data["log_assembled_numpktexp"],
-                        "assembled_numnack": csv_data["log_assembled_numnack"],
-                        "bitrate": csv_data["bitrate"],
-                    }
+                predictions[int(frame_id)] = frame_data["pred"]
             except ValueError:
                 continue
+    return predictions
 
-    # Sort frames by timestamp for consistent ordering
-    sorted_frames = sorted(frame_predictions.items(), key=lambda x: x[1]["timestamp"])
 
-    return frame_predictions, sorted_frames
+def correlate_frame_data(predictions, frame_data_csv):
+    """Correlate detector predictions with frame data.
+
+    Args:
+        predictions: Detector predictions keyed by frame number
+        frame_data_csv: Frame metadata columns (timestamps, resolutions, sizes, QP, NACK, bitrate)
+
+    Returns:
+        Dict of columns for the frames with a prediction, sorted by timestamp
+    """
+    # Keep the frames the detector scored
+    frame_indices = frame_data_csv["frame_index"]
+    matched = np.isin(frame_indices, list(predictions))
+    pred = np.fromiter(
+        (predictions[frame_num] for frame_num in frame_indices[matched].tolist()),
+        float,
+        np.count_nonzero(matched),
+    )
+
+    # Frames are already in timestamp order
+    return {
+        "pred": pred,
+        "timestamp": frame_data_csv["timestamp"][matched],
+        "width": frame_data_csv["width"][matched],
+        "height": frame_data_csv["height"][matched],
+        "resolution": frame_data_csv["resolution"][matched],
+        "size": frame_data_csv["size"][matched],
+        "qp": frame_data_csv["log_qp"][matched],
+        "assembled_numpktexp": frame_data_csv["log_assembled_numpktexp"][matched],
+        "assembled_numnack": frame_data_csv["log_assembled_numnack"][matched],
+        "bitrate": frame_data_csv["bitrate"][matched],
+    }
 
 
 # TODO: Celeb-DF only
 def infer_video_cfg(video_id, config):
     if config["dataset_name"] == "Celeb-DF-v1":
-        stripped_video_id = os.path.basename(
-            video_id.replace(config["video_suffix"], "")
-        )
+        stripped_video_id = Path(video_id).stem
         if "Celeb-synthesis" in video_id:
             return "fake", stripped_video_id
         else:
@@ -136,77 +196,240 @@ def infer_video_cfg(video_id, config):
         return "", ""
 
 
-def plot_video_metrics(frames, figure_title, figure_path, metrics):
-    def plot_metric(ax, metric, frames, colors):
-        start_idx = 0
-        cur_idx = 0
-        prev_resolution = frames[0][1]["resolution"]
-        while cur_idx < len(frames):
-            resolution = frames[cur_idx][1]["resolution"]
-            if resolution != prev_resolution:
-                # Segment ends; plot
-                timestamps = [
-                    frm["timestamp"] for frm_id, frm in frames[start_idx:cur_idx]
-                ]
-                predictions = [frm[metric] for frm_id, frm in frames[start_idx:cur_idx]]
-                ax.plot(
-                    timestamps,
-                    predictions,
-                    color=colors[prev_resolution],
+# Resolution of the saved figures
+FIGURE_DPI = 150
+
+# Longer line segments are downsampled to this many points before plotting
+PLOT_MAX_POINTS = 2000
+# Only segments shorter than this get a marker per frame
+PLOT_MARKER_MAX_POINTS = 500
+
+
+def lttb_indices(x, y, n_out):
+    """Pick n_out point indices that keep the shape of a series (Largest-Triangle-Three-Buckets)."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # First and last points are kept; the rest are split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    selected = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Third triangle vertex: the next bucket's average, or the last point
+        if i < n_out - 3:
+            next_x = x[end : edges[i + 2]].mean()
+            next_y = y[end : edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # Keep the bucket point forming the largest triangle with its neighbours
+        areas = np.abs(
+            (x[selected] - next_x) * (y[start:end] - y[selected])
+            - (x[selected] - x[start:end]) * (next_y - y[selected])
+        )
+        selected = start + int(np.argmax(areas))
+        indices[i + 1] = selected
+    return indices
+
+
+def create_metric_figure(num_plots):
+    """Create a figure with one row of axes per metric, sharing the time axis."""
+    fig, axes = plt.subplots(
+        num_plots, 1, figsize=(12, 3 * num_plots), sharex=True, dpi=FIGURE_DPI
+    )
+    if num_plots == 1:
+        axes = [axes]
+    return fig, axes
+
+
+def write_png(pixels, figure_path):
+    """Encode an RGBA pixel buffer and write it as a PNG."""
+    # Light zlib compression; these are diagnostic plots
+    Image.fromarray(pixels, "RGBA").save(
+        figure_path, compress_level=1, dpi=(FIGURE_DPI, FIGURE_DPI)
+    )
+    print(f"Plot saved as: {figure_path}")
+
+
+def plot_video_metrics(
+    fig,
+    axes,
+    frames,
+    resolutions,
+    colors,
+    figure_title,
+    figure_path,
+    metrics,
+    png_writer,
+):
+    def plot_metric(ax, metric, frames, colors, bounds):
+        ts = frames["timestamp"]
+        vals = frames[metric]
+        codes = frames["resolution_code"]
+
+        # One line per run of frames with the same resolution, drawn together
+        segments = []
+        segment_colors = []
+        marker_ranges = []
+        for s, e in zip(bounds[:-1], bounds[1:]):
+            keep = lttb_indices(ts[s:e], vals[s:e], PLOT_MAX_POINTS)
+            segments.append(np.column_stack((ts[s:e][keep], vals[s:e][keep])))
+            segment_colors.append(colors[codes[s]])
+            if e - s < PLOT_MARKER_MAX_POINTS:
+                marker_ranges.append((s, e))
+        ax.add_collection(
+            LineCollection(segments, colors=segment_colors, linewidths=2, alpha=0.9)
+        )
+
+        # Markers for the short segments, as one scatter
+        if marker_ranges:
+            marker_idx = np.concatenate([np.arange(s, e) for s, e in marker_ranges])
+            ax.scatter(
+                ts[marker_idx],
+                vals[marker_idx],
+                s=9,
+                c=colors[codes[marker_idx]],
+                alpha=0.9,
+            )
+        ax.autoscale_view()
+
+        if metric == "pred":
+            ax.axhline(y=0.5, color="red", linestyle="--", alpha=0.7, linewidth=1.5)
+            # One legend entry per resolution present
+            handles = [
+                Line2D(
+                    [],
+                    [],
+                    color=colors[code],
                     linewidth=2,
                     marker="o",
                     markersize=3,
                     alpha=0.9,
-                    label=prev_resolution,
+                    label=resolutions[code],
                 )
-                start_idx = cur_idx
-                prev_resolution = resolution
-            cur_idx += 1
-        # Plot last segment
-        timestamps = [frm["timestamp"] for frm_id, frm in frames[start_idx:cur_idx]]
-        predictions = [frm[metric] for frm_id, frm in frames[start_idx:cur_idx]]
-        ax.plot(
-            timestamps,
-            predictions,
-            color=colors[prev_resolution],
-            linewidth=2,
-            marker="o",
-            markersize=3,
-            alpha=0.9,
-            label=prev_resolution,
-        )
-        if metric == "pred":
-            ax.axhline(y=0.5, color="red", linestyle="--", alpha=0.7, linewidth=1.5)
-            ax.legend(loc="upper right", title="Resolution")
-
-    # split by resolutions
-    resolutions = set()
-    for frame_index, frame_data in frames:
-        resolutions.add(frame_data["resolution"])
+                for code in np.unique(codes[bounds[:-1]])
+            ]
+            ax.legend(handles=handles, loc="upper right", title="Resolution")
 
-    colors = dict(zip(resolutions, plt.cm.tab10(range(len(resolutions)))))
+    # Resolution runs are the same for every metric; find them once
+    codes = frames["resolution_code"]
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1, [len(codes)]))
 
+    # The figure is reused across calls; start from empty axes
     num_plots = len(metrics)
-    fig, axes = plt.subplots(num_plots, 1, figsize=(12, 3 * num_plots), sharex=True)
-    if num_plots == 1:
-        axes = [axes]
+    for ax in axes:
+        ax.cla()
 
     # Plot main figure
     ax = axes[0]
     metric = metrics[0]
-    plot_metric(ax, metric, frames, colors)
+    plot_metric(ax, metric, frames, colors, bounds)
     ax.set_title(figure_title)
     ax.set_ylabel(metric)
 
     for i in range(1, num_plots):
         ax = axes[i]
-        plot_metric(ax, metrics[i], frames, colors)
+        plot_metric(ax, metrics[i], frames, colors, bounds)
         ax.set_ylabel(metrics[i])
     axes[-1].set_xlabel("Time (s)")
 
-    plt.savefig(figure_path, dpi=300, bbox_inches="tight")
-    plt.close()
-    print(f"Plot saved as: {figure_path}")
+    # Fit the layout up front; bbox_inches="tight" would render the figure twice
+    fig.tight_layout()
+
+    # Rasterize here, then leave PNG encoding and the write to png_writer so
+    # they overlap with the next plot; the pixels are copied since the figure
+    # is redrawn
+    fig.canvas.draw()
+    pixels = np.array(fig.canvas.buffer_rgba())
+    return png_writer.submit(write_png, pixels, figure_path)
+
+
+def plot_video(config, video_id, figure_title, frames_data, figure_dir, metrics):
+    """Correlate one video's detector predictions with its frame data and plot them."""
+    print(f"Processing {video_id}")
+    frame_summary_path = os.path.join(
+        config["processed_rtc_dir"],
+        config["dataset_name"],
+        str(Path(video_id).with_suffix(".csv")),
+    )
+    predictions = parse_predictions(frames_data)
+    frame_data_csv = load_frame_data(frame_summary_path, predictions.keys())
+    if not frame_data_csv:
+        print(f"Warning: Frame summary file not found or empty: {frame_summary_path}")
+        return
+    frames = correlate_frame_data(predictions, frame_data_csv)
+    timestamps = frames["timestamp"]
+    if timestamps.size == 0:
+        print(f"Warning: No detector predictions match frames in {frame_summary_path}")
+        return
+
+    # One figure per video, redrawn for each interval and the full plot
+    fig, axes = create_metric_figure(len(metrics))
+
+    # Integer code per resolution, and a fixed color per code (in sorted
+    # resolution order) across the video's plots
+    resolutions, codes = np.unique(frames["resolution"], return_inverse=True)
+    frames["resolution_code"] = codes
+    colors = plt.cm.tab10(np.arange(len(resolutions)) % 10)
+
+    # PNG writes run in the background while the next plot is drawn
+    with ThreadPoolExecutor(max_workers=2) as png_writer:
+        writes = []
+
+        # An interval ends at the first frame more than plot_interval after
+        # its start; the last, unfinished interval is only in the full plot
+        start_idx = 0
+        while True:
+            start_timestamp = timestamps[start_idx]
+            idx = bisect.bisect_right(
+                timestamps,
+                config["plot_interval"],
+                lo=start_idx,
+                key=lambda t: t - start_timestamp,
+            )
+            if idx >= len(timestamps):
+                break
+            timestamp = round(start_timestamp)
+            figure_path = os.path.join(figure_dir, f"{figure_title}-{timestamp}.png")
+            writes.append(
+                plot_video_metrics(
+                    fig,
+                    axes,
+                    {name: column[start_idx:idx] for name, column in frames.items()},
+                    resolutions,
+                    colors,
+                    f"{figure_title}-{timestamp}",
+                    figure_path,
+                    metrics,
+                    png_writer,
+                )
+            )
+            start_idx = idx
+
+        # Plot
+        figure_path = os.path.join(figure_dir, f"{figure_title}.png")
+        writes.append(
+            plot_video_metrics(
+                fig,
+                axes,
+                frames,
+                resolutions,
+                colors,
+                figure_title,
+                figure_path,
+                metrics,
+                png_writer,
+            )
+        )
+        plt.close(fig)
+
+        # Surface write errors
+        for write in writes:
+            write.result()
 
 
 def main():
@@ -219,7 +442,7 @@ def main():
 
     # Load configuration
     with open(args.config, "r") as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
     with open(config["visualize_list"], "r") as f:
         video_lists = [line.strip() for line in f]
@@ -255,51 +478,27 @@ def main():
     if config["dataset_name"] in detector_data:
         dataset_data = detector_data[config["dataset_name"]]
         if "video" in dataset_data:
-            for stripped_id, frames_data in dataset_data["video"].items():
-                video_id = video_cfg[stripped_id]["video_id"]
-                print(f"Processing {video_id}")
-                frame_summary_path = os.path.join(
-                    config["processed_rtc_dir"],
-                    config["dataset_name"],
-                    video_id.replace(config["video_suffix"], ".csv"),
-                )
-                frame_data_csv = load_frame_data(frame_summary_path)
-                if not frame_data_csv:
-                    print(
-                        f"Warning: Frame summary file not found or empty: {frame_summary_path}"
+            # Videos are independent; plot them in parallel
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+                futures = [
+                    executor.submit(
+                        plot_video,
+                        config,
+                        video_cfg[stripped_id]["video_id"],
+                        f"{video_cfg[stripped_id]['label']}-{stripped_id}-{config['detector']}",
+                        frames_data,
+                        figure_dir,
+                        metrics,
                     )
-                    continue
-                frame_predictions, sorted_frames = correlate_frame_data(
-                    frames_data, frame_data_csv
-                )
+                    for stripped_id, frames_data in dataset_data["video"].items()
+                ]
 
-                figure_title = f"{video_cfg[stripped_id]['label']}-{stripped_id}-{config['detector']}"
-                idx = 0
-                prev_timestamp = sorted_frames[idx][1]["timestamp"]
-                start_idx = idx
-                while idx < len(sorted_frames):
-                    if (
-                        sorted_frames[idx][1]["timestamp"] - prev_timestamp
-                        > config["plot_interval"]
-                    ):
-                        timestamp = round(prev_timestamp)
-                        figure_path = os.path.join(
-                            figure_dir, f"{figure_title}-{timestamp}.png"
-                        )
-                        plot_video_metrics(
-                            sorted_frames[start_idx:idx],
-                            f"{figure_title}-{timestamp}",
-                            figure_path,
-                            metrics,
-                        )
-                        prev_timestamp = sorted_frames[idx][1]["timestamp"]
-                        start_idx = idx
-                    idx += 1
-
-                # Plot
-                figure_title = f"{video_cfg[stripped_id]['label']}-{stripped_id}-{config['detector']}"
-                figure_path = os.path.join(figure_dir, f"{figure_title}.png")
-                plot_video_metrics(sorted_frames, figure_title, figure_path, metrics)
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception:
+                        executor.shutdown(cancel_futures=True)
+                        raise
 
     else:
         print(